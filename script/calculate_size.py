@@ -1,60 +1,45 @@
-# read ines from stdin and calculate the size of the input
+# read lines from stdin (or from the files named on the command line) and
+# calculate the size of the input
 # each line looks like this:
 # [   ] AST_L1T_00301292025000337_20250311065724_2860944.hdf           2025-03-11 06:59  119M
 # the size is found in the last column, and the size is in B, M, K, G, or T
 # the output should be the sum of all sizes in B
 # if the input is empty the output should be 0
 
+import mmap
+import os
+import re
 import sys
-from typing import Union
-
-
-def humanize_bytes(num_bytes: Union[int, float]) -> str:
-    """
-    Convert a number of bytes into a human-readable format (e.g., KB, MB, GB).
-
-    Args:
-        num_bytes: Number of bytes
-
-    Return:
-        Human-readable string
-    """
-    if num_bytes < 1024:
-        return f"{num_bytes} bytes"
-    elif num_bytes < 1024**2:
-        return f"{num_bytes / 1024:.2f} Kb"
-    elif num_bytes < 1024**3:
-        return f"{num_bytes / 1024**2:.2f} Mb"
-    elif num_bytes < 1024**4:
-        return f"{num_bytes / 1024**3:.2f} Gb"
-    else:
-        return f"{num_bytes / 1024**4:.2f} Tb"
-
-
-def calculate_size():
-    size = 0
-    for line in sys.stdin:
-        size += convert_to_bytes(line)
-    print(humanize_bytes(size))
-
-
-def convert_to_bytes(line):
-    size = line.split()[-1]
-    value = float(size[:-1])
-    unit = size[-1]
-    if unit == "B":
-        return value
-    elif unit == "K":
-        return value * 1024
-    elif unit == "M":
-        return value * 1024 * 1024
-    elif unit == "G":
-        return value * 1024 * 1024 * 1024
-    elif unit == "T":
-        return value * 1024 * 1024 * 1024 * 1024
-    else:
-        raise ValueError(f"Unknown unit: {unit}")
+
+from downlow.utils import humanize_bytes
+
+# the size column at the end of each line, e.g. "119M" or "4.2K"
+SIZE_RE = re.compile(rb"(\d+(?:\.\d+)?)([BKMGT])\s*$", re.MULTILINE)
+UNIT_BYTES = {b"B": 1, b"K": 1024, b"M": 1024**2, b"G": 1024**3, b"T": 1024**4}
+
+
+def calculate_size(paths=()):
+    if not paths:
+        print(humanize_bytes(total_bytes(sys.stdin.buffer.read())))
+        return
+    print(humanize_bytes(sum(file_total_bytes(path) for path in paths)))
+
+
+def file_total_bytes(path):
+    # map the file rather than reading it into memory; mmap can't map an
+    # empty file, which has no sizes in it anyway
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return total_bytes(data)
+
+
+def total_bytes(data):
+    # one regex pass over the whole input, rather than splitting line by line;
+    # lines without a size (headers, directories marked "-") are skipped
+    return sum(float(value) * UNIT_BYTES[unit] for value, unit in SIZE_RE.findall(data))
 
 
 if __name__ == "__main__":
-    calculate_size()
+    calculate_size(sys.argv[1:])
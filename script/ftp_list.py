@@ -1,20 +1,53 @@
 import functools
+import html
 import os
 import re
 import sys
 import urllib.parse
 import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from enum import Enum, auto
 from urllib.parse import urljoin
 
 import click
 import dotenv
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from loguru import logger
+from requests.adapters import HTTPAdapter
 
 dotenv.load_dotenv()
 
+DEFAULT_WORKERS = 16
+
+# one session for the whole crawl, so directory fetches reuse connections
+SESSION = requests.Session()
+
+# lxml's C parser is much faster on large directory listings; fall back to
+# the pure-Python parser when it isn't installed
+try:
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# we only ever look at links, so only build tree nodes for them
+ANCHORS = SoupStrainer("a", href=True)
+
+# Apache and nginx autoindex pages are regular enough to scan for links
+# directly, without building a tree at all
+AUTOINDEX_TITLE = re.compile(r"<title>\s*Index of ", re.IGNORECASE)
+AUTOINDEX_ANCHOR = re.compile(
+    r"""<a\s[^>]*?href\s*=\s*(?:"([^"]*)"|'([^']*)')[^>]*>(.*?)</a>""", re.IGNORECASE | re.DOTALL
+)
+# any <a> tag, to check the scan above didn't miss links it couldn't read
+ANCHOR_TAG = re.compile(r"<a\s", re.IGNORECASE)
+# HTML comments, which may hold commented-out links
+COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+# markup inside a link's text, e.g. <b>...</b>
+TAG = re.compile(r"<[^>]*>")
+
 
 class LinkType(Enum):
     """Enum for different types of links."""
@@ -43,7 +76,7 @@ def get_page_content(url):
         logger.error(f"Unsupported scheme: {parsed.scheme}")
         return None
     try:
-        response = requests.get(url, timeout=5 * 60, headers=headers())
+        response = SESSION.get(url, timeout=5 * 60, headers=headers())
     except urllib.error.URLError as e:
         logger.error(f"Error fetching URL {url}: {e}")
         return None
@@ -81,30 +114,45 @@ def clean_url(url):
     return url.replace("http://", "https://")
 
 
-def should_ignore(url, ignore_patterns):
-    """Check if URL matches any of the ignore patterns."""
+def compile_ignore_patterns(ignore_patterns):
+    """Combine the ignore patterns into a single regex, or None if there are none."""
     if not ignore_patterns:
-        return False
+        return None
+
+    return re.compile("|".join(f"(?:{pattern})" for pattern in ignore_patterns))
+
+
+def should_ignore(url, ignore_regex):
+    """Check if URL matches the combined ignore regex."""
+    return bool(ignore_regex and ignore_regex.search(url))
+
+
+def iter_anchors(html_content):
+    """Yield (href, text) for each link in HTML content."""
+    if AUTOINDEX_TITLE.search(html_content):
+        content = COMMENT.sub("", html_content)
+        anchors = AUTOINDEX_ANCHOR.findall(content)
+        # if some links couldn't be read (e.g. unquoted hrefs), let
+        # BeautifulSoup have the page instead
+        if len(anchors) == len(ANCHOR_TAG.findall(content)):
+            for double_quoted, single_quoted, text in anchors:
+                yield html.unescape(double_quoted or single_quoted), html.unescape(TAG.sub("", text)).strip()
+            return
 
-    return any(re.search(pattern, url) for pattern in ignore_patterns)
+    soup = BeautifulSoup(html_content, HTML_PARSER, parse_only=ANCHORS)
+    for anchor in soup.find_all("a"):
+        yield anchor["href"], anchor.text.strip()
 
 
-def extract_links(html_content, base_url, ignore_patterns=None):
+def extract_links(html_content, base_url, ignore_regex=None):
     """Extract all links from HTML content."""
     if not html_content:
         return [], []
 
-    soup = BeautifulSoup(html_content, "html.parser")
     file_links = []
     dir_links = []
 
-    for anchor in soup.find_all("a"):
-        if not anchor.has_attr("href"):
-            continue
-
-        link_url = anchor["href"]
-        link_text = anchor.text.strip()
-
+    for link_url, link_text in iter_anchors(html_content):
         # Skip links that are not relative or point to the same domain
         if link_url.startswith("http") and base_url not in link_url:
             continue
@@ -112,7 +160,7 @@ def extract_links(html_content, base_url, ignore_patterns=None):
         full_url = urljoin(base_url, link_url)
 
         # Skip ignored URLs
-        if should_ignore(full_url, ignore_patterns):
+        if should_ignore(full_url, ignore_regex):
             logger.debug(f"Ignoring: {full_url}")
             continue
 
@@ -126,28 +174,43 @@ def extract_links(html_content, base_url, ignore_patterns=None):
     return sorted(set(file_links)), sorted(set(dir_links))
 
 
-def crawl_directory(url, visited=None, ignore_patterns=None):
-    """Recursively crawl directory listings, yielding URLs as they are found."""
+def fetch_links(url, ignore_regex=None):
+    """Fetch a directory listing and extract its file and directory links."""
+    logger.info(f"Crawling: {url}")
+    html_content = get_page_content(url)
+    return extract_links(html_content, url, ignore_regex)
+
+
+def crawl_directory(url, visited=None, ignore_regex=None, workers=DEFAULT_WORKERS):
+    """Crawl directory listings breadth first, yielding URLs as they are found."""
     if visited is None:
         visited = set()
 
-    if url in visited or should_ignore(url, ignore_patterns):
+    if url in visited or should_ignore(url, ignore_regex):
         return
 
     visited.add(url)
-    logger.info(f"Crawling: {url}")
 
-    html_content = get_page_content(url)
-    file_links, dir_links = extract_links(html_content, url, ignore_patterns)
+    # Keep up to `workers` directory fetches in flight; only this generator
+    # touches `visited`, so it needs no lock
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(fetch_links, url, ignore_regex)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_links, dir_links = future.result()
 
-    # Yield file URLs as we find them
-    for file_url in file_links:
-        logger.debug(f"Found file: {file_url}")
-        yield file_url
+                # Yield file URLs as we find them
+                for file_url in file_links:
+                    logger.debug(f"Found file: {file_url}")
+                    yield file_url
 
-    # Recursively process directories
-    for dir_link in dir_links:
-        yield from crawl_directory(dir_link, visited, ignore_patterns)
+                # Queue up directories we haven't seen yet
+                for dir_link in dir_links:
+                    if dir_link in visited or should_ignore(dir_link, ignore_regex):
+                        continue
+                    visited.add(dir_link)
+                    pending.add(executor.submit(fetch_links, dir_link, ignore_regex))
 
 
 @click.command()
@@ -156,7 +219,8 @@ def crawl_directory(url, visited=None, ignore_patterns=None):
 @click.option("-i", "--ignore", multiple=True, help="Pattern to ignore (regex). Can be used multiple times.")
 @click.option("--verbose", is_flag=True, help="Enable verbose logging")
 @click.option("--quiet", is_flag=True, help="Only show warnings and errors")
-def main(url, output, ignore, verbose, quiet):
+@click.option("--workers", default=DEFAULT_WORKERS, show_default=True, help="Number of directories to fetch at once")
+def main(url, output, ignore, verbose, quiet, workers):
     """Extract file URLs from directory listings."""
     # Configure logger
     logger.remove()  # Remove default handler
@@ -171,17 +235,23 @@ def main(url, output, ignore, verbose, quiet):
     ignore_patterns = list(ignore) if ignore else []
     if ignore_patterns:
         logger.info(f"Ignoring URLs matching: {', '.join(ignore_patterns)}")
+    ignore_regex = compile_ignore_patterns(ignore_patterns)
+
+    # size the connection pool to match the number of concurrent fetches
+    adapter = HTTPAdapter(pool_maxsize=workers)
+    SESSION.mount("http://", adapter)
+    SESSION.mount("https://", adapter)
 
     # Process URLs as they are yielded
     url_count = 0
     if output:
         with open(output, "w") as f:
-            for file_url in crawl_directory(url, ignore_patterns=ignore_patterns):
+            for file_url in crawl_directory(url, ignore_regex=ignore_regex, workers=workers):
                 f.write(file_url + "\n")
                 url_count += 1
         logger.success(f"Wrote {url_count} URLs to {output}")
     else:
-        for file_url in crawl_directory(url, ignore_patterns=ignore_patterns):
+        for file_url in crawl_directory(url, ignore_regex=ignore_regex, workers=workers):
             print(file_url)
             url_count += 1
         logger.success(f"Found {url_count} URLs")
@@ -3,14 +3,19 @@
 import os
 import random
 import re
+import shutil
 import sys
+import threading
 import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Union
-from urllib.parse import urlparse
+from urllib.parse import ParseResult, urlparse
 
 import click
 import requests  # type: ignore[import-untyped]
 from loguru import logger
+from requests.adapters import HTTPAdapter  # type: ignore[import-untyped]
 
 from downlow.downlow_data_classes import (
     CONNECTION_ERROR,
@@ -24,10 +29,17 @@ from downlow.utils import (
     humanize_seconds,
     is_file_with_extension,
     is_valid_url,
+    list_files,
     longest_common_prefix,
+    preallocate,
     sleep,
 )
 
+COPY_BUFFER_SIZE = 1024 * 1024  # bytes
+POOL_CONNECTIONS = 32  # number of hosts to keep connection pools for
+# status codes with which a server asks us to slow down
+RATE_LIMITED_STATUS_CODES = frozenset((429, 503))
+
 
 class Downloader:
     def __init__(
@@ -36,6 +48,7 @@ class Downloader:
         download_dir: str,
         prefixes_to_remove: Union[list[str], None] = None,
         max_tries: int = 10,
+        workers: int = 16,
     ) -> None:
         self.urls = urls
         self.download_dir = download_dir
@@ -46,17 +59,86 @@ class Downloader:
         self.max_tries = max_tries
         self.start_time = time.time()
         self.bytes_downloaded = 0.0
+        self.workers = workers
+        # scan the download directory once, rather than stat'ing every file
+        self.existing_files = list_files(download_dir)
+        # normalized paths of the files being downloaded right now
+        self._downloading: set[str] = set()
+        # When a server asks us to slow down, every worker waits: no request
+        # is sent before _resume_at (Retry-After, or backing off from a 429 or
+        # 503), and while the server paces us (remaining requests / reset),
+        # requests start at least _interval seconds after the last one
+        self._resume_at = 0.0
+        self._interval: Union[int, float] = 0
+        self._last_turn = 0.0
+        # guards the counters and the state above, which are used from worker threads
+        self._lock = threading.Lock()
+        # one session for all workers, so requests to the same host reuse
+        # connections; retries are handled by _download_with_retries, not urllib3
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=workers, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self) -> "Downloader":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the HTTP session and its pooled connections.
+        """
+        self.session.close()
 
-    def download_file(self, url: str, attempt_number: int) -> DownloadResult:  # noqa: C901
+    def _wait_for_turn(self) -> None:
+        """
+        Wait until the server's rate limits allow another request, from any worker.
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._resume_at, self._last_turn + self._interval)
+            self._last_turn = start
+        # progress bars from concurrent workers would trample each other
+        sleep(start - now, show_progress=self.workers == 1)
+
+    def _slow_down(self, result: DownloadResult) -> None:
+        """
+        Wait as long as a result's wait_time_policy says before the next request.
+        The server's own rate limiting (Retry-After, a 429 or 503, remaining
+        requests / reset) holds up every worker; backing off from any other
+        failure only holds up this one.
+
+        Args:
+            result: The result of a download attempt.
+        """
+        wait_time = result.wait_time_policy()
+        rate_limits = result.rate_limits
+        retry_after = rate_limits.retry_n > 0
+        pacing = not retry_after and rate_limits.remaining_n > 0 and rate_limits.reset_n > 0
+        with self._lock:
+            self._interval = wait_time if pacing else 0
+            if retry_after or result.status_code in RATE_LIMITED_STATUS_CODES:
+                self._resume_at = max(self._resume_at, time.time() + wait_time)
+                return
+        if not pacing:
+            sleep(wait_time, show_progress=self.workers == 1)
+
+    def download_file(
+        self, url: str, attempt_number: int, parsed: Union[bool, ParseResult, None] = None
+    ) -> DownloadResult:
         """
         Download a file from a URL.
 
         Args:
             url: URL to download.
             attempt_number: Number of the download attempt.
+            parsed: The result of is_valid_url on the URL, if already known.
         """
         url = url.strip()
-        parsed = is_valid_url(url)
+        if parsed is None:
+            parsed = is_valid_url(url)
         if not parsed:
             logger.error(f"Invalid URL: {url}")
             return DownloadResult(url, False, 0, blank_rate_limits(), True, attempt_number)
@@ -71,85 +153,179 @@ class Downloader:
         if not is_file_with_extension(local_path):
             logger.error(f"Invalid filename: {local_path}")
             return DownloadResult(url, False, 0, blank_rate_limits(), True, attempt_number)
-        if os.path.exists(local_path):
+        key = os.path.normpath(local_path)
+        # existing_files doesn't look inside symlinked directories, so check
+        # the disk on a miss; we are about to download the file anyway. The
+        # stat can be slow on network mounts, so it is done without the lock
+        exists = key in self.existing_files or os.path.exists(local_path)
+        with self._lock:
+            if not exists:
+                # another worker may be downloading this very file (the same
+                # URL twice, or URLs that map to the same path once prefixes
+                # are removed), or have just finished it; leave it to them
+                exists = key in self.existing_files or key in self._downloading
+                if not exists:
+                    self._downloading.add(key)
+            if exists:
+                self.number_of_existing_files += 1
+        if exists:
             logger.info(f"{local_path} already exists, skipping.")
-            self.number_of_existing_files += 1
             return DownloadResult(url, True, 200, blank_rate_limits(), True, attempt_number)
+        try:
+            return self._fetch(url, local_path, attempt_number)
+        finally:
+            with self._lock:
+                self._downloading.discard(key)
+
+    def _fetch(self, url: str, local_path: str, attempt_number: int) -> DownloadResult:
+        """
+        Fetch a URL and write it to local_path.
+
+        Args:
+            url: URL to download.
+            local_path: Path to write the file to.
+            attempt_number: Number of the download attempt.
+        """
         # OK, let's try to download the file
+        self._wait_for_turn()
         try:
-            r = requests.get(url, stream=True, timeout=31)
+            r = self.session.get(url, stream=True, timeout=31)
         except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
             logger.error(f"Request failed: {e}")
-            self.number_of_failed_downloads += 1
+            with self._lock:
+                self.number_of_failed_downloads += 1
             return DownloadResult(url, False, CONNECTION_ERROR, blank_rate_limits(), False, attempt_number)
 
-        status_code = r.status_code
-        logger.trace(f"Headers: {r.headers}")
-        rate_limits = get_rate_limits(dict(r.headers))
-        logger.debug(f"RATE LIMITS: {rate_limits}")
-        success = status_code >= 200 and status_code < 300
-        logger.debug(f"SUCCESS: {success}; STATUS CODE: {status_code}; URL: {url}")
-        content_length = r.headers.get("Content-Length")
-        sz = "Unknown"
-        if content_length:
-            sz = humanize_bytes(int(content_length))
-            self.bytes_downloaded += int(content_length)
-        logger.debug(f"Content length: {sz}")
-        download_result = DownloadResult(url, success, status_code, rate_limits, False, attempt_number)
-        if success:
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            # if we fail to write the content, well, let's just fail
-            try:
-                with open(local_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-            except Exception as e:
-                logger.error(f"Error writing to {local_path}: {e}")
-                self.number_of_failed_downloads += 1
-                return download_result
-            # Preserve the file modification time
-            if "Last-Modified" in r.headers:
-                last_modified = r.headers["Last-Modified"]
-                mod_time = time.mktime(time.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z"))
-                os.utime(local_path, (mod_time, mod_time))
-            self.number_of_successful_downloads += 1
-            time_elapsed = time.time() - self.start_time
-            if time_elapsed == 0:
-                time_elapsed = 0.1
-            byte_rate_per_minute = humanize_bytes(self.bytes_downloaded / time_elapsed * 60)
-            file_rate = humanize_rate(self.number_of_successful_downloads, time_elapsed)
-            logger.info(
-                f"Downloaded {url} to {local_path}; Content size: {sz}; File rate: {file_rate}; Content rate: {byte_rate_per_minute}/m; time elapsed: {humanize_seconds(time_elapsed)}"
-            )
-
-        else:
-            logger.error(f"Error downloading {url}, result: {download_result}")
-            self.number_of_failed_downloads += 1
-        return download_result
+        # close the response on every path, so its connection goes back to the pool
+        with r:
+            status_code = r.status_code
+            headers = r.headers
+            logger.trace(f"Headers: {headers}")
+            rate_limits = get_rate_limits(headers)
+            logger.debug(f"RATE LIMITS: {rate_limits}")
+            success = status_code >= 200 and status_code < 300
+            logger.debug(f"SUCCESS: {success}; STATUS CODE: {status_code}; URL: {url}")
+            content_length = headers.get("Content-Length")
+            sz = "Unknown"
+            if content_length:
+                sz = humanize_bytes(int(content_length))
+                with self._lock:
+                    self.bytes_downloaded += int(content_length)
+            logger.debug(f"Content length: {sz}")
+            download_result = DownloadResult(url, success, status_code, rate_limits, False, attempt_number)
+            if success:
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                # if we fail to write the content, well, let's just fail
+                try:
+                    # let urllib3 undo any Content-Encoding
+                    r.raw.decode_content = True
+                    with open(local_path, "wb") as f:
+                        if content_length and int(content_length) < COPY_BUFFER_SIZE:
+                            # small files (the common case when crawling) are read in one go
+                            f.write(r.raw.read())
+                        else:
+                            # otherwise, copy in 1 MiB blocks
+                            if content_length:
+                                preallocate(f.fileno(), int(content_length))
+                            shutil.copyfileobj(r.raw, f, length=COPY_BUFFER_SIZE)
+                            # a decoded body can be shorter than its Content-Length
+                            f.truncate()
+                except Exception as e:
+                    logger.error(f"Error writing to {local_path}: {e}")
+                    with self._lock:
+                        self.number_of_failed_downloads += 1
+                    return download_result
+                # Preserve the file modification time
+                last_modified = headers.get("Last-Modified")
+                if last_modified:
+                    mod_time = time.mktime(time.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z"))
+                    os.utime(local_path, (mod_time, mod_time))
+                with self._lock:
+                    self.existing_files.add(os.path.normpath(local_path))
+                    self.number_of_successful_downloads += 1
+                    number_of_successful_downloads = self.number_of_successful_downloads
+                    bytes_downloaded = self.bytes_downloaded
+                time_elapsed = time.time() - self.start_time
+                if time_elapsed == 0:
+                    time_elapsed = 0.1
+                byte_rate_per_minute = humanize_bytes(bytes_downloaded / time_elapsed * 60)
+                file_rate = humanize_rate(number_of_successful_downloads, time_elapsed)
+                logger.info(
+                    f"Downloaded {url} to {local_path}; Content size: {sz}; File rate: {file_rate}; Content rate: {byte_rate_per_minute}/m; time elapsed: {humanize_seconds(time_elapsed)}"
+                )
 
-    def download_all(self) -> None:
+            else:
+                logger.error(f"Error downloading {url}, result: {download_result}")
+                with self._lock:
+                    self.number_of_failed_downloads += 1
+            return download_result
+
+    def _download_with_retries(self, url: str) -> Union[DownloadResult, None]:
         """
-        Download all URLs in the list.
+        Download a URL, retrying with backoff until it succeeds, is skipped,
+        or we run out of tries.
 
+        Args:
+            url: URL to download.
+
+        Returns:
+            The result of the last download attempt.
+        """
+        result = None
+        # parse once; every retry of this URL reuses the result
+        parsed = is_valid_url(url.strip())
+        for attempt_number in range(self.max_tries):
+            if attempt_number > 0:
+                logger.info(f"Attempt number {attempt_number + 1} to download {url}")
+            result = self.download_file(url, attempt_number + 1, parsed)
+            if not result.skip:
+                self._slow_down(result)
+            if result.success or result.skip:
+                break
+        if result and not (result.success or result.skip):
+            logger.error(f"Failed to download {url} after {self.max_tries} attempts")
+        return result
 
+    def download_all(self) -> None:
+        """
+        Download all URLs in the list, using a pool of worker threads.
         """
         number_of_urls = len(self.urls)
-        for i, url in enumerate(self.urls, start=1):
-            percent_done = 100.0 * i / number_of_urls
-            logger.info(f"Downloading {i}/{number_of_urls} ({percent_done:.2f}%): {url} ...")
-            result = None
-            for attempt_number in range(self.max_tries):
-                if attempt_number > 0:
-                    logger.info(f"Attempt number {attempt_number + 1} to download {url}")
-                result = self.download_file(url, attempt_number + 1)
-                sleep_time = result.wait_time_policy()
-                if sleep_time > 0:
-                    sleep(sleep_time)
-                if result.success or result.skip:
-                    break
-            if not (result or result.success) and not result.skip:  # type: ignore[union-attr]
-                logger.error(f"Failed to download {url} after {self.max_tries} attempts")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._download_with_retries, url): url for url in self.urls}
+            for i, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                percent_done = 100.0 * i / number_of_urls
+                logger.info(f"Processed {i}/{number_of_urls} ({percent_done:.2f}%): {futures[future]}")
+
+
+def read_urls(
+    lines: Iterable[str], pattern: Union[re.Pattern, None] = None, reverse: bool = False
+) -> tuple[list[str], int]:
+    """
+    Read URLs, one per line, skipping blank lines and lines starting with #,
+    and keeping only those matching the pattern (or not matching it, if
+    reverse is set). This is done in a single pass over the lines.
+
+    Args:
+        lines: Lines to read URLs from, e.g. an open file.
+        pattern: Regular expression URLs must match, if any.
+        reverse: Keep the URLs which do not match the pattern instead.
+
+    Returns:
+        The URLs to download, and the number of URLs before filtering by pattern.
+    """
+    search = pattern.search if pattern else None
+    urls = []
+    number_of_candidates = 0
+    for line in lines:
+        url = line.strip()
+        if not url or url[0] == "#":
+            continue
+        number_of_candidates += 1
+        if search is None or bool(search(url)) != reverse:
+            urls.append(url)
+    return urls, number_of_candidates
 
 
 @click.command()
@@ -214,6 +390,12 @@ class Downloader:
     show_default=True,
     help="Maximum number of retries on request failures",
 )
+@click.option(
+    "--workers",
+    default=16,
+    show_default=True,
+    help="Number of concurrent downloads",
+)
 @click.version_option(version="1.0.0")
 @click.option(
     "--dry-run",
@@ -232,6 +414,7 @@ def main(
     log_file: str,
     log_level: str = "INFO",
     max_tries: int = 10,
+    workers: int = 16,
     dry_run: bool = False,
 ) -> None:
     """
@@ -243,26 +426,18 @@ def main(
     if log_file:
         logger.add(log_file, level=log_level.upper())
     prefixes_to_remove = list(prefixes_to_remove)
+    pattern = re.compile(regex) if regex else None
     if not url_file:
         logger.info("Reading URLs from standard input.")
-        urls = [url.strip() for url in sys.stdin.readlines()]
+        urls, number_of_candidates = read_urls(sys.stdin, pattern, reverse)
     else:
         logger.info(f"Reading URLs from file: {url_file}")
         with open(url_file) as f:
-            urls = [url.strip() for url in f.readlines()]
-
-    # strip empty URLs and lines starting with #
-    urls = [url for url in urls if url and not url.startswith("#")]
+            urls, number_of_candidates = read_urls(f, pattern, reverse)
 
     if regex:
-        pattern = re.compile(regex)
-        old_len = len(urls)
-        if reverse:
-            urls = [url for url in urls if not pattern.search(url)]
-            logger.info(f"Filtered URLs from {old_len} to {len(urls)} which do not match regex: {regex}")
-        else:
-            urls = [url for url in urls if pattern.search(url)]
-            logger.info(f"Filtered URLs from {old_len} to {len(urls)} which match regex: {regex}")
+        which = "do not match" if reverse else "match"
+        logger.info(f"Filtered URLs from {number_of_candidates} to {len(urls)} which {which} regex: {regex}")
 
     if randomize:
         random.shuffle(urls)
@@ -274,8 +449,8 @@ def main(
         logger.info("Dry run enabled; not downloading files.")
         logger.info(f"Would download {len(urls)} URLs to {download_dir}")
         return
-    downloader = Downloader(urls, download_dir, prefixes_to_remove, max_tries=max_tries)
-    downloader.download_all()
+    with Downloader(urls, download_dir, prefixes_to_remove, max_tries=max_tries, workers=workers) as downloader:
+        downloader.download_all()
     logger.info(f"Download complete; processed {len(urls)} URLs")
     logger.info(f"Number of existing files: {downloader.number_of_existing_files}")
     logger.info(f"Number of successful downloads: {downloader.number_of_successful_downloads}")
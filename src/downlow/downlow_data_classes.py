@@ -1,52 +1,64 @@
-import enum
-import re
+import math
+import sys
 import time
+from collections.abc import Mapping
 from dataclasses import dataclass
-from typing import Union
+from functools import lru_cache
+from typing import Any, NamedTuple, Union
 
 MAX_WAIT_TIME = 2**20  # seconds, about 292 hours
 CONNECTION_ERROR = -1  # magic number for connection error
+# rate limit reset values larger than this are Unix epoch times, not durations
+_EPOCH_THRESHOLD = 1_000_000_000  # seconds
+# status codes to back off from, even on a first attempt
+_RETRYABLE_STATUS_CODES = frozenset((429, 503, CONNECTION_ERROR))
+# exponential backoff, in seconds, indexed by attempt number - 1
+_BACKOFF = tuple(1 << i for i in range(32))
 
+# These classes are created for every download attempt, so give them slots
+# where we can; dataclass(slots=True) needs Python 3.10+
+_SLOTS: dict[str, Any] = {"slots": True} if sys.version_info >= (3, 10) else {}
 
-class RateLimitState(enum.Enum):
+
+def _header_names(prefixes: tuple[str, ...], stem: str, separators: tuple[str, ...], suffix: str) -> tuple[str, ...]:
+    """
+    Spell out every header name matched by a pattern like (X-|)Rate-?Limit-Remaining,
+    lowercased, i.e. each prefix + stem + separator + suffix.
+    """
+    return tuple(f"{prefix}{stem}{separator}{suffix}" for prefix in prefixes for separator in separators)
+
+
+# Every (lowercased) header name for each rate limit value. Looking these up
+# directly is much cheaper than running a regex over every header; to accept
+# a new variant, add its prefix or separator here.
+_REMAINING_KEYS = _header_names(("x-", ""), "rate", ("-", ""), "limit-remaining")
+_LIMIT_KEYS = _header_names(("x-", ""), "rate", ("-", ""), "limit-limit")
+_RETRY_KEYS = _header_names(("",), "retry", ("-", ""), "after")
+_RESET_KEYS = _header_names(("x-", ""), "rate", ("-", ""), "limit-reset")
+# and which RateLimits field each of those header names fills in
+_FIELD_NAMES = {
+    **dict.fromkeys(_REMAINING_KEYS, "remaining"),
+    **dict.fromkeys(_LIMIT_KEYS, "rate_limit"),
+    **dict.fromkeys(_RETRY_KEYS, "retry_after"),
+    **dict.fromkeys(_RESET_KEYS, "reset_after"),
+}
+# the RateLimits fields, in order
+_RATE_LIMIT_FIELDS = ("remaining", "rate_limit", "retry_after", "reset_after")
+
+
+class RateLimitState:
     """
-    Record state of rate limit information.
+    Record state of rate limit information. The states are plain bools, so
+    checking a state is just a truth test.
     UNKNOWN: We don't know anything about the rate limit.
     KNOWN: We know the rate limit.
     """
 
-    UNKNOWN = 1
-    KNOWN = 2
-
-
-def find_key_matching(headers: dict[str, str], regex: re.Pattern) -> Union[None, str]:
-    """
-    Given a regular expression, find the first key in the headers that matches
-    the regular expression.
-
-    Args:
-        headers: A dictionary of headers.
-        regex: A regular expression to match against the keys in the headers.
-    Returns:
-        The first key that matches the regular expression, or None if no key
-        matches.
+    UNKNOWN = False
+    KNOWN = True
 
-    Examples:
 
-    > find_key_matching({"X-Rate-Limit-Remaining": "100"}, re.compile(r"(X-|)Rate-?Limit-Remaining", re.IGNORECASE))
-    "X-Rate-Limit-Remaining"
-    > find_key_matching({"Retry-After": "100"}, re.compile(r"Retry-?After", re.IGNORECASE))
-    "Retry-After"
-    > find_key_matching({}, re.compile(r"Retry-?After", re.IGNORECASE))
-    None
-    """
-    for key in headers:
-        if regex.fullmatch(key):
-            return key
-    return None
-
-
-@dataclass
+@dataclass(frozen=True, **_SLOTS)
 class RateLimitPair:
     """
     A pair of rate limit values, with a state indicating whether the value is
@@ -54,35 +66,65 @@ class RateLimitPair:
 
     Attributes:
         n: The value of the rate limit.
-        state: The state of the rate limit, indicating whether it is known or
-            unknown.
+        state: The state of the rate limit, RateLimitState.KNOWN (True) or
+            RateLimitState.UNKNOWN (False).
     """
 
     n: int
-    state: RateLimitState
+    state: bool
 
 
-@dataclass
-class RateLimits:
+class RateLimits(NamedTuple):
     """
-    A collection of rate limit values, with a state indicating whether the
-    value is actually known or unknown.
+    A collection of rate limit values, each with a flag indicating whether the
+    value is actually known or unknown. The values are kept flat in a single
+    tuple; the remaining, rate_limit, retry_after and reset_after properties
+    return them as RateLimitPairs.
     Attributes:
-        remaining: The number of requests remaining in the current rate limit
-            window.
-        rate_limit: The maximum number of requests allowed in the current
-            rate limit window.
-        retry_after: The amount of time to wait before making another request.
-        reset_after: The amount of time until the rate limit window resets.
+        remaining_n: The number of requests remaining in the current rate
+            limit window.
+        limit_n: The maximum number of requests allowed in the current rate
+            limit window.
+        retry_n: The amount of time to wait before making another request.
+        reset_n: The amount of time until the rate limit window resets.
+        *_known: Whether the corresponding value is known
+            (RateLimitState.KNOWN) or not (RateLimitState.UNKNOWN).
     """
 
-    remaining: RateLimitPair
-    rate_limit: RateLimitPair
-    retry_after: RateLimitPair
-    reset_after: RateLimitPair
+    remaining_n: int
+    remaining_known: bool
+    limit_n: int
+    limit_known: bool
+    retry_n: int
+    retry_known: bool
+    reset_n: int
+    reset_known: bool
+
+    @property
+    def remaining(self) -> RateLimitPair:
+        return RateLimitPair(self.remaining_n, self.remaining_known)
+
+    @property
+    def rate_limit(self) -> RateLimitPair:
+        return RateLimitPair(self.limit_n, self.limit_known)
+
+    @property
+    def retry_after(self) -> RateLimitPair:
+        return RateLimitPair(self.retry_n, self.retry_known)
+
+    @property
+    def reset_after(self) -> RateLimitPair:
+        return RateLimitPair(self.reset_n, self.reset_known)
+
+
+# RateLimits are immutable, so responses without any rate limit headers can
+# all share one
+_UNKNOWN_PAIR = RateLimitPair(0, RateLimitState.UNKNOWN)
+_UNKNOWN = (0, RateLimitState.UNKNOWN)
+_BLANK_RATE_LIMITS = RateLimits(*_UNKNOWN * 4)
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class DownloadResult:
     """
     A result of a download attempt, including the URL, success status,
@@ -114,62 +156,100 @@ class DownloadResult:
         Returns:
             The wait time in seconds.
         """
-        # if for some reason we are skipping this item, we do not need to wait
-        if self.skip:
+        # if for some reason we are skipping this item, we do not need to wait;
+        # nor if the first attempt worked and the server told us nothing
+        # about rate limits, which is by far the most common case
+        if self.skip or (self.success and self.attempt_number <= 1 and self.rate_limits is _BLANK_RATE_LIMITS):
             return 0
+        # An UNKNOWN rate limit value is always 0 (see get_rate_limits and
+        # blank_rate_limits), so n > 0 alone means the value is known
+        rate_limits = self.rate_limits
+        retry_after = rate_limits.retry_n
         # if we have a retry-after header, we should wait that amount of time
         # but perhaps not more than the MAX_WAIT_TIME
-        if self.rate_limits.retry_after.n > 0 and self.rate_limits.retry_after.state == RateLimitState.KNOWN:
-            return min(self.rate_limits.retry_after.n, MAX_WAIT_TIME)
+        if retry_after > 0:
+            return min(retry_after, MAX_WAIT_TIME)
         ## If we have both a RateLimitRemaining and RateLimitReset header, we
-        ## can calculate how long to wait. But we need to check if the
-        ## RateLimitReset is a Unix epoch time or a duration in seconds
-        if (
-            self.rate_limits.remaining.n > 0
-            and self.rate_limits.remaining.state == RateLimitState.KNOWN
-            and self.rate_limits.reset_after.n > 0
-            and self.rate_limits.reset_after.state == RateLimitState.KNOWN
-        ):
-            if self.rate_limits.reset_after.n > 1000000000:
-                duration = self.rate_limits.reset_after.n - time.time()
-            else:
-                duration = self.rate_limits.reset_after.n
+        ## can calculate how long to wait. The reset is always a duration in
+        ## seconds here; reset_duration converted any Unix epoch time when the
+        ## headers were parsed
+        remaining = rate_limits.remaining_n
+        reset_after = rate_limits.reset_n
+        if remaining > 0 and reset_after > 0:
             # we can only do n calls in duration seconds, so we should wait
             # duration / n seconds
-            return duration / self.rate_limits.remaining.n
+            return reset_after / remaining
         ## if the status is 429, a server problem, or a connection problem
         ## we should wait 2^attempt_number seconds
         ## Or, we are just at attempt 2 etc.
-        if self.status_code in [429, 503, CONNECTION_ERROR] or self.attempt_number > 1:
-            return 2 ** (self.attempt_number - 1)  # type: ignore[no-any-return]
+        if self.status_code in _RETRYABLE_STATUS_CODES or self.attempt_number > 1:
+            return _BACKOFF[min(max(self.attempt_number - 1, 0), len(_BACKOFF) - 1)]
         ## if we know *nothing* then don't wait
         return 0
 
 
-def get_rate_limit_key(regex: re.Pattern, headers: dict) -> RateLimitPair:
+def reset_duration(reset: int) -> int:
     """
-    Get a rate limit key from the headers.
+    Servers send the rate limit reset either as a duration in seconds, or as
+    the Unix epoch time at which the limit resets. Convert the latter to a
+    duration from now, so it is measured when the header arrives rather than
+    whenever the wait time is worked out.
 
     Args:
-        regex: A regular expression to match against the keys in the headers.
-        headers: A dictionary of headers.
+        reset: The value of the rate limit reset header.
+
+    Returns:
+        The number of seconds until the rate limit resets (which may be 0 or
+        less, if the reset time has already passed).
+
+    Examples:
+    > reset_duration(60)
+    60
+    > reset_duration(int(time.time()) + 60)
+    60
+    """
+    if reset > _EPOCH_THRESHOLD:
+        return math.ceil(reset - time.time())
+    return reset
+
+
+def lowercase_headers(headers: Mapping[str, str]) -> dict[str, str]:
+    """
+    Lowercase the names of the headers, so they can be looked up directly.
+
+    Args:
+        headers: A mapping of headers, e.g. a response's headers.
+
+    Returns:
+        A dictionary of the headers, keyed by lowercased name.
+    """
+    return {key.lower(): value for key, value in headers.items()}
+
+
+def get_rate_limit_value(keys: tuple[str, ...], lower_headers: Mapping[str, str]) -> RateLimitPair:
+    """
+    Get a rate limit value from headers whose names have been lowercased.
+
+    Args:
+        keys: The lowercased header names the value might be found under.
+        lower_headers: A mapping of headers, keyed by lowercased name.
 
     Returns:
         A RateLimitPair with the value of the rate limit and whether it is actually
         known or unknown.
     """
-    key = find_key_matching(headers, regex)
-    if key:
-        return RateLimitPair(int(headers[key]), RateLimitState.KNOWN)
-    return RateLimitPair(0, RateLimitState.UNKNOWN)
+    for key in keys:
+        if key in lower_headers:
+            return RateLimitPair(int(lower_headers[key]), RateLimitState.KNOWN)
+    return _UNKNOWN_PAIR
 
 
-def get_quota_remaining(headers: dict) -> RateLimitPair:  # pragma: no cover
+def get_quota_remaining(headers: Mapping[str, str]) -> RateLimitPair:  # pragma: no cover
     """
     Get the remaining quota from the headers.
 
     Args:
-        headers: A dictionary of headers.
+        headers: A mapping of headers, e.g. a response's headers.
 
     Returns:
         A RateLimitPair with the remaining quota and its state.
@@ -182,11 +262,10 @@ def get_quota_remaining(headers: dict) -> RateLimitPair:  # pragma: no cover
     > get_quota_remaining({})
     RateLimitPair(0, RateLimitState.UNKNOWN)
     """
-    regex = re.compile(r"(X-|)Rate-?Limit-Remaining", re.IGNORECASE)
-    return get_rate_limit_key(regex, headers)
+    return get_rate_limit_value(_REMAINING_KEYS, lowercase_headers(headers))
 
 
-def get_rate_limit(headers: dict) -> RateLimitPair:  # pragma: no cover
+def get_rate_limit(headers: Mapping[str, str]) -> RateLimitPair:  # pragma: no cover
     """
     > get_rate_limit({"X-Rate-Limit-Limit": "100"})
     RateLimitPair(100, RateLimitState.KNOWN)
@@ -195,11 +274,10 @@ def get_rate_limit(headers: dict) -> RateLimitPair:  # pragma: no cover
     > get_rate_limit({})
     RateLimitPair(0, RateLimitState.UNKNOWN)
     """
-    regex = re.compile(r"(X-|)Rate-?Limit-Limit", re.IGNORECASE)
-    return get_rate_limit_key(regex, headers)
+    return get_rate_limit_value(_LIMIT_KEYS, lowercase_headers(headers))
 
 
-def get_retry_after(headers: dict) -> RateLimitPair:  # pragma: no cover
+def get_retry_after(headers: Mapping[str, str]) -> RateLimitPair:  # pragma: no cover
     """
     > get_retry_after({"Retry-After": "100"})
     RateLimitPair(100, RateLimitState.KNOWN)
@@ -208,11 +286,10 @@ def get_retry_after(headers: dict) -> RateLimitPair:  # pragma: no cover
     > get_retry_after({})
     RateLimitPair(0, RateLimitState.UNKNOWN)
     """
-    regex = re.compile(r"Retry-?After", re.IGNORECASE)
-    return get_rate_limit_key(regex, headers)
+    return get_rate_limit_value(_RETRY_KEYS, lowercase_headers(headers))
 
 
-def get_ratelimit_reset(headers: dict) -> RateLimitPair:  # pragma: no cover
+def get_ratelimit_reset(headers: Mapping[str, str]) -> RateLimitPair:  # pragma: no cover
     """
     > get_ratelimit_reset({"X-Rate-Limit-Reset": "100"})
     RateLimitPair(100, RateLimitState.KNOWN)
@@ -221,25 +298,57 @@ def get_ratelimit_reset(headers: dict) -> RateLimitPair:  # pragma: no cover
     > get_ratelimit_reset({})
     RateLimitPair(0, RateLimitState.UNKNOWN)
     """
-    regex = re.compile(r"(X-|)Rate-?Limit-Reset", re.IGNORECASE)
-    return get_rate_limit_key(regex, headers)
+    reset = get_rate_limit_value(_RESET_KEYS, lowercase_headers(headers))
+    if reset.state:
+        return RateLimitPair(reset_duration(reset.n), reset.state)
+    return reset
 
 
-def get_rate_limits(headers: dict) -> RateLimits:
+def get_rate_limits(headers: Mapping[str, str]) -> RateLimits:
     """
     Get all the rate limits from the headers.
 
     Args:
-        headers: A dictionary of headers.
+        headers: A mapping of headers, e.g. a response's headers.
 
     Returns:
         A RateLimits object with all the rate limits and their states.
     """
-    quota_remaining = get_quota_remaining(headers)
-    rate_limit = get_rate_limit(headers)
-    retry_after = get_retry_after(headers)
-    reset_after = get_ratelimit_reset(headers)
-    return RateLimits(quota_remaining, rate_limit, retry_after, reset_after)
+    # one pass over the headers to find the values; the first header found
+    # for a field wins
+    values: dict[str, str] = {}
+    field_name = _FIELD_NAMES.get
+    for key, value in headers.items():
+        field = field_name(key.lower())
+        if field and field not in values:
+            values[field] = value
+    if not values:
+        return _BLANK_RATE_LIMITS
+    raw_values = tuple(values.get(field) for field in _RATE_LIMIT_FIELDS)
+    # isdigit alone would pass e.g. a Latin-1 superscript two, which int() rejects
+    if all(value is None or (value.isascii() and value.isdigit()) for value in raw_values):
+        rate_limits = _parse_rate_limits(raw_values)
+    else:
+        # anything unusual (padding, signs, junk) is parsed, or fails to
+        # parse, without going through the cache
+        rate_limits = _parse_rate_limits.__wrapped__(raw_values)
+    # an epoch reset depends on the current time, so it can't be cached
+    reset_after = rate_limits.reset_n
+    if reset_after > _EPOCH_THRESHOLD:
+        rate_limits = rate_limits._replace(reset_n=reset_duration(reset_after))
+    return rate_limits
+
+
+@lru_cache(maxsize=1024)
+def _parse_rate_limits(values: tuple[Union[str, None], ...]) -> RateLimits:
+    # Successive responses from a server usually carry the same rate limit
+    # headers, so cache the parsed (immutable) RateLimits on the raw values,
+    # which are in _RATE_LIMIT_FIELDS order, None for a missing header
+    _int, known = int, RateLimitState.KNOWN
+    flat: list[Any] = []
+    for value in values:
+        flat += _UNKNOWN if value is None else (_int(value), known)
+    return RateLimits(*flat)
 
 
 def blank_rate_limits() -> RateLimits:
@@ -247,12 +356,9 @@ def blank_rate_limits() -> RateLimits:
     Return a blank RateLimits object with all values set to 0 and state set to UNKNOWN.
     This is useful for initializing a RateLimits object when no headers are available.
 
+    RateLimits are immutable, so this is always the same object.
+
     Returns:
         A RateLimits object with all values set to 0 and state set to UNKNOWN.
     """
-    return RateLimits(
-        RateLimitPair(0, RateLimitState.UNKNOWN),
-        RateLimitPair(0, RateLimitState.UNKNOWN),
-        RateLimitPair(0, RateLimitState.UNKNOWN),
-        RateLimitPair(0, RateLimitState.UNKNOWN),
-    )
+    return _BLANK_RATE_LIMITS
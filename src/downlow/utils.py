@@ -1,11 +1,20 @@
+import contextlib
 import os
 import time
+from functools import lru_cache
 from typing import Union
 from urllib.parse import ParseResult, urlparse
 
 import tldextract
 from rich.progress import track
 
+# use the public suffix list snapshot bundled with tldextract, rather than
+# fetching (or re-reading a cached copy of) the list at runtime
+_EXTRACT = tldextract.TLDExtract(suffix_list_urls=())
+
+_BYTE_UNITS = ("bytes", "Kb", "Mb", "Gb", "Tb")
+_BYTE_DIVISORS = tuple(1024**i for i in range(len(_BYTE_UNITS)))
+
 
 def humanize_bytes(num_bytes: Union[int, float]) -> str:
     """
@@ -19,14 +28,9 @@ def humanize_bytes(num_bytes: Union[int, float]) -> str:
     """
     if num_bytes < 1024:
         return f"{num_bytes} bytes"
-    elif num_bytes < 1024**2:
-        return f"{num_bytes / 1024:.2f} Kb"
-    elif num_bytes < 1024**3:
-        return f"{num_bytes / 1024**2:.2f} Mb"
-    elif num_bytes < 1024**4:
-        return f"{num_bytes / 1024**3:.2f} Gb"
-    else:
-        return f"{num_bytes / 1024**4:.2f} Tb"
+    # each unit is 10 more bits than the one before it
+    i = min((int(num_bytes).bit_length() - 1) // 10, len(_BYTE_UNITS) - 1)
+    return f"{num_bytes / _BYTE_DIVISORS[i]:.2f} {_BYTE_UNITS[i]}"
 
 
 def humanize_seconds(seconds: Union[int, float]) -> str:
@@ -116,41 +120,34 @@ def longest_common_prefix(strs: list[str]) -> str:
     > longest_common_prefix(["throne", "dungeon"])
     ""
     """
-    if not strs:
-        return ""
-
-    # Start with the first string as the prefix
-    prefix = strs[0]
-
-    # Compare the prefix with each string in the list
-    for string in strs[1:]:
-        # Reduce the prefix length until it matches the start of the string
-        while string[: len(prefix)] != prefix:
-            prefix = prefix[:-1]
-            if not prefix:
-                return ""
+    # os.path.commonprefix works character by character, not path component
+    # by path component, which is what we want here
+    return os.path.commonprefix(strs)  # noqa: RUF071
 
-    return prefix
 
-
-def sleep(seconds: Union[int, float]) -> None:
+def sleep(seconds: Union[int, float], show_progress: bool = False) -> None:
     """
-    Sleep for a given number of seconds, with progress tracking.
+    Sleep for a given number of seconds, with optional progress tracking.
 
     Args:
         seconds: Number of seconds to sleep
+        show_progress: Whether to show a progress bar while sleeping
 
     Returns:
         None
     """
-    if seconds:
-        time_slept = 0.00
-        seconds_times_ten = int(seconds * 10)
-        for _ in track(range(seconds_times_ten), description="Sleeping"):
-            time.sleep(0.01)
-            time_slept += 0.01
-            if time_slept >= seconds:
-                break
+    if seconds <= 0:
+        return
+    if not show_progress:
+        time.sleep(seconds)
+        return
+    # update the progress bar every tenth of a second
+    ticks = int(seconds * 10)
+    for _ in track(range(ticks), description="Sleeping"):
+        time.sleep(0.1)
+    remainder = seconds - ticks / 10
+    if remainder > 0:
+        time.sleep(remainder)
 
 
 def get_tld(url: str) -> str:
@@ -173,10 +170,16 @@ def get_tld(url: str) -> str:
     > get_tld("ftp://example")
     ""
     """
-    extracted = tldextract.extract(url)
-    return extracted.suffix
+    # most bulk downloads hit a handful of hosts, so cache on the host name
+    return _host_suffix(urlparse(url).hostname or url)
+
 
+@lru_cache(maxsize=4096)
+def _host_suffix(host: str) -> str:
+    return _EXTRACT(host).suffix
 
+
+@lru_cache(maxsize=16384)
 def is_valid_url(url: str) -> Union[bool, ParseResult]:
     """
     Is this a valid URL, for our puposes?
@@ -221,4 +224,54 @@ def is_file_with_extension(path: str) -> bool:
     > is_file_with_extension("/some/dir/john.txt")
     True
     """
-    return all(os.path.splitext(os.path.basename(path)))
+    # same as all(os.path.splitext(...)): a dot somewhere after the first
+    # character, ignoring leading dots as in ".bashrc"
+    return os.path.basename(path).lstrip(".").rfind(".") > 0
+
+
+def preallocate(fd: int, size: int) -> None:
+    """
+    Reserve disk space for a file we are about to write, where the platform
+    supports it (e.g., Linux). This lets the file system allocate the file in
+    one go rather than growing it a block at a time.
+
+    Args:
+        fd: File descriptor of a file opened for writing.
+        size: Number of bytes to reserve.
+
+    Returns:
+        None
+    """
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    # not every file system supports this; it is only ever an optimization
+    with contextlib.suppress(OSError):
+        os.posix_fallocate(fd, 0, size)
+
+
+def list_files(root: str) -> set[str]:
+    """
+    List all the files under a directory, recursively. Symlinks to
+    directories are not followed, so files under them are not listed.
+
+    Args:
+        root: The directory to list.
+
+    Returns:
+        A set of normalized file paths, each starting with root; empty if root
+        does not exist.
+    """
+    files = set()
+    directories = [root]
+    while directories:
+        try:
+            entries = os.scandir(directories.pop())
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                else:
+                    files.add(os.path.normpath(entry.path))
+    return files
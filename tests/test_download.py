@@ -0,0 +1,154 @@
+import io
+import re
+import time
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from downlow.download import Downloader, read_urls
+from downlow.downlow_data_classes import DownloadResult, blank_rate_limits, get_rate_limits
+
+
+def test_download_all_downloads_every_url(tmp_path):
+    urls = [f"https://example.com/file{i}.txt" for i in range(20)]
+    downloader = Downloader(urls, str(tmp_path), workers=4)
+    with patch.object(
+        downloader,
+        "download_file",
+        side_effect=lambda url, attempt_number, parsed: DownloadResult(
+            url, True, 200, blank_rate_limits(), False, attempt_number
+        ),
+    ) as mock_download_file:
+        downloader.download_all()
+    assert sorted(call.args[0] for call in mock_download_file.call_args_list) == sorted(urls)
+
+
+@patch("downlow.download.sleep", return_value=None)
+def test_download_with_retries_stops_on_success(mock_sleep, tmp_path):
+    url = "https://example.com/file.txt"
+    downloader = Downloader([url], str(tmp_path), max_tries=5)
+    results = [
+        DownloadResult(url, False, 503, blank_rate_limits(), False, 1),
+        DownloadResult(url, True, 200, blank_rate_limits(), False, 2),
+    ]
+    with patch.object(downloader, "download_file", side_effect=results) as mock_download_file:
+        result = downloader._download_with_retries(url)
+    assert result is not None
+    assert result.success
+    assert mock_download_file.call_count == 2
+
+
+def test_download_file_skips_existing_files(tmp_path):
+    (tmp_path / "file.txt").write_text("already here")
+    downloader = Downloader(["https://example.com/file.txt"], str(tmp_path))
+    with patch.object(downloader.session, "get") as mock_get:
+        result = downloader.download_file("https://example.com/file.txt", 1)
+    assert result.skip
+    assert downloader.number_of_existing_files == 1
+    mock_get.assert_not_called()
+
+
+def test_read_urls():
+    lines = ["https://example.com/a.txt\n", "\n", "# a comment\n", "  https://example.com/b.csv  \n"]
+    assert read_urls(lines) == (["https://example.com/a.txt", "https://example.com/b.csv"], 2)
+    assert read_urls(lines, re.compile(r"\.csv$")) == (["https://example.com/b.csv"], 2)
+    assert read_urls(lines, re.compile(r"\.csv$"), reverse=True) == (["https://example.com/a.txt"], 2)
+
+
+def test_download_file_skips_existing_files_under_symlinks(tmp_path):
+    (tmp_path / "elsewhere").mkdir()
+    (tmp_path / "elsewhere" / "file.txt").write_text("already here")
+    (tmp_path / "download").mkdir()
+    (tmp_path / "download" / "linked").symlink_to(tmp_path / "elsewhere")
+    downloader = Downloader(["https://example.com/linked/file.txt"], str(tmp_path / "download"))
+    with patch.object(downloader.session, "get") as mock_get:
+        result = downloader.download_file("https://example.com/linked/file.txt", 1)
+    assert result.skip
+    mock_get.assert_not_called()
+
+
+def test_download_all_downloads_duplicate_urls_once(tmp_path):
+    def get(url, **kwargs):
+        time.sleep(0.1)
+        response = MagicMock(status_code=200, headers={"Content-Length": "5"})
+        response.raw = io.BytesIO(b"hello")
+        return response
+
+    urls = ["https://example.com/file.txt"] * 4
+    downloader = Downloader(urls, str(tmp_path), workers=4)
+    with patch.object(downloader.session, "get", side_effect=get) as mock_get:
+        downloader.download_all()
+    assert mock_get.call_count == 1
+    assert downloader.number_of_successful_downloads == 1
+    assert downloader.number_of_existing_files == 3
+    assert (tmp_path / "file.txt").read_bytes() == b"hello"
+
+
+def _result(status_code, headers=None, attempt_number=1):
+    return DownloadResult(
+        "https://example.com/file.txt", False, status_code, get_rate_limits(headers or {}), False, attempt_number
+    )
+
+
+def _sleeps(mock_sleep):
+    return [round(call.args[0]) for call in mock_sleep.call_args_list]
+
+
+@patch("downlow.download.sleep", return_value=None)
+def test_retry_after_pauses_every_worker_once(mock_sleep, tmp_path):
+    downloader = Downloader([], str(tmp_path), workers=16)
+    downloader._slow_down(_result(429, {"Retry-After": "512"}))
+    for _ in range(16):
+        downloader._wait_for_turn()
+    assert _sleeps(mock_sleep) == [512] * 16
+
+
+def test_retry_after_pause_is_not_repeated(tmp_path):
+    # a clock that moves on when we sleep, as one worker would see it
+    now = [1_000_000.0]
+    sleeps = []
+
+    def fake_sleep(seconds, show_progress=False):
+        sleeps.append(round(seconds))
+        now[0] += max(seconds, 0)
+
+    downloader = Downloader([], str(tmp_path), workers=1)
+    with patch("downlow.download.sleep", side_effect=fake_sleep), patch("downlow.download.time") as mock_time:
+        mock_time.time.side_effect = lambda: now[0]
+        downloader._slow_down(_result(429, {"Retry-After": "60"}))
+        downloader._wait_for_turn()
+        downloader._slow_down(DownloadResult("https://example.com/file.txt", True, 200, blank_rate_limits(), False, 2))
+        downloader._wait_for_turn()
+        downloader._wait_for_turn()
+    # the successful second attempt still backs off (2s) on its own, as it
+    # always has, but the Retry-After pause isn't waited out again
+    assert sleeps == [60, 2, 0, 0]
+
+
+@patch("downlow.download.sleep", return_value=None)
+def test_pacing_spaces_out_requests(mock_sleep, tmp_path):
+    downloader = Downloader([], str(tmp_path), workers=4)
+    downloader._slow_down(_result(200, {"X-Rate-Limit-Remaining": "30", "X-Rate-Limit-Reset": "60"}))
+    for _ in range(3):
+        downloader._wait_for_turn()
+    assert _sleeps(mock_sleep) == [0, 2, 4]
+
+
+@patch("downlow.download.sleep", return_value=None)
+def test_backoff_from_other_failures_is_not_shared(mock_sleep, tmp_path):
+    downloader = Downloader([], str(tmp_path), workers=4)
+    downloader._slow_down(_result(404, attempt_number=3))
+    assert _sleeps(mock_sleep) == [4]
+    downloader._wait_for_turn()
+    assert _sleeps(mock_sleep) == [4, 0]
+
+
+def test_download_file_closes_failed_responses(tmp_path):
+    response = requests.Response()
+    response.status_code = 503
+    response.raw = MagicMock()
+    downloader = Downloader(["https://example.com/file.txt"], str(tmp_path))
+    with patch.object(downloader.session, "get", return_value=response):
+        result = downloader.download_file("https://example.com/file.txt", 1)
+    assert not result.success
+    response.raw.release_conn.assert_called_once()
@@ -1,24 +1,17 @@
-import re
+import time
+
+import pytest
 
 from downlow.downlow_data_classes import (
     CONNECTION_ERROR,
     MAX_WAIT_TIME,
     DownloadResult,
     RateLimitState,
-    find_key_matching,
+    _parse_rate_limits,
     get_rate_limits,
 )
 
 
-def test_find_key_matching():
-    headers = {"X-Rate-Limit-Remaining": "100", "X-Rate-Limit-Limit": "1000", "Retry-After": "60"}
-    assert find_key_matching(headers, re.compile(r"X-Rate-Limit-Remaining", re.IGNORECASE)) == "X-Rate-Limit-Remaining"
-    assert find_key_matching(headers, re.compile(r"X-Rate-Limit-Limit", re.IGNORECASE)) == "X-Rate-Limit-Limit"
-    assert find_key_matching(headers, re.compile(r"Retry-After", re.IGNORECASE)) == "Retry-After"
-    assert find_key_matching(headers, re.compile(r"Non-Existent-Key", re.IGNORECASE)) is None
-    assert find_key_matching(headers, re.compile(r"X-Rate-Limit-Remaining", re.IGNORECASE)) == "X-Rate-Limit-Remaining"
-
-
 def test_get_rate_limits():
     headers = {"X-Rate-Limit-Remaining": "100", "X-Rate-Limit-Limit": "1000", "Retry-After": "60"}
     rate_limits = get_rate_limits(headers)
@@ -30,6 +23,16 @@ def test_get_rate_limits():
     assert rate_limits.retry_after.state == RateLimitState.KNOWN
     assert rate_limits.reset_after.n == 0
     assert rate_limits.reset_after.state == RateLimitState.UNKNOWN
+    assert tuple(rate_limits) == (100, True, 1000, True, 60, True, 0, False)
+
+
+def test_get_rate_limits_header_variants():
+    headers = {"ratelimit-remaining": "5", "X-RateLimit-Limit": "10", "RETRYAFTER": "3", "Rate-Limit-Reset": "30"}
+    rate_limits = get_rate_limits(headers)
+    assert rate_limits.remaining.n == 5
+    assert rate_limits.rate_limit.n == 10
+    assert rate_limits.retry_after.n == 3
+    assert rate_limits.reset_after.n == 30
 
 
 def test_wait_time_policy_skipped():
@@ -109,6 +112,19 @@ def test_wait_time_policy_various_failures():
         assert result.wait_time_policy() == 8  # 2 ** (4-1)
 
 
+def test_wait_time_policy_backoff_is_clamped():
+    for attempt_number, expected in [(0, 1), (1, 1), (32, 2**31), (100, 2**31)]:
+        result = DownloadResult(
+            url="https://example.com/file.txt",
+            success=False,
+            status_code=503,
+            rate_limits=get_rate_limits({}),
+            skip=False,
+            attempt_number=attempt_number,
+        )
+        assert result.wait_time_policy() == expected
+
+
 def test_wait_time_policy_unknown_infomation():
     result = DownloadResult(
         url="https://example.com/file.txt",
@@ -128,3 +144,49 @@ def test_wait_time_policy_unknown_infomation():
         attempt_number=2,
     )
     assert result_2.wait_time_policy() == 2
+
+
+def test_wait_time_policy_success():
+    result = DownloadResult(
+        url="https://example.com/file.txt",
+        success=True,
+        status_code=200,
+        rate_limits=get_rate_limits({"Content-Type": "text/plain"}),
+        skip=False,
+        attempt_number=1,
+    )
+    assert result.wait_time_policy() == 0
+    # a successful download still paces itself by the server's rate limits
+    result_2 = DownloadResult(
+        url="https://example.com/file.txt",
+        success=True,
+        status_code=200,
+        rate_limits=get_rate_limits({"X-Rate-Limit-Remaining": "30", "X-Rate-Limit-Reset": "60"}),
+        skip=False,
+        attempt_number=1,
+    )
+    assert result_2.wait_time_policy() == 2
+
+
+def test_get_rate_limits_is_cached():
+    headers = {"X-Rate-Limit-Remaining": "100", "Retry-After": "60", "Content-Type": "text/plain"}
+    assert get_rate_limits(headers) is get_rate_limits(dict(headers))
+
+
+def test_get_rate_limits_epoch_reset():
+    rate_limits = get_rate_limits({"X-Rate-Limit-Reset": str(int(time.time()) + 60)})
+    assert 59 <= rate_limits.reset_after.n <= 60
+    assert rate_limits.reset_after.state == RateLimitState.KNOWN
+
+
+def test_get_rate_limits_unusual_values_are_not_cached():
+    rate_limits = get_rate_limits({"Retry-After": " 5 "})
+    assert rate_limits.retry_after.n == 5
+    assert rate_limits is not get_rate_limits({"Retry-After": " 5 "})
+    with pytest.raises(ValueError):
+        get_rate_limits({"Retry-After": "soon"})
+    # a superscript two passes str.isdigit, but int() rejects it
+    misses = _parse_rate_limits.cache_info().misses
+    with pytest.raises(ValueError):
+        get_rate_limits({"Retry-After": "\u00b2"})
+    assert _parse_rate_limits.cache_info().misses == misses
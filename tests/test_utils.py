@@ -1,6 +1,16 @@
 from unittest.mock import patch
 
-from downlow.utils import get_tld, humanize_bytes, humanize_rate, humanize_seconds, is_valid_url, longest_common_prefix
+from downlow.utils import (
+    get_tld,
+    humanize_bytes,
+    humanize_rate,
+    humanize_seconds,
+    is_file_with_extension,
+    is_valid_url,
+    list_files,
+    longest_common_prefix,
+    preallocate,
+)
 from downlow.utils import sleep as util_sleep
 
 
@@ -51,10 +61,18 @@ def test_longest_common_prefix():
 @patch("time.sleep", return_value=None)
 @patch("rich.progress.track", side_effect=lambda x, description: x)
 def test_sleep(mock_track, mock_sleep):
-    util_sleep(10)
+    util_sleep(10, show_progress=True)
     assert mock_sleep.call_count == 100
 
 
+@patch("time.sleep", return_value=None)
+def test_sleep_without_progress(mock_sleep):
+    util_sleep(10)
+    mock_sleep.assert_called_once_with(10)
+    util_sleep(0)
+    mock_sleep.assert_called_once_with(10)
+
+
 def test_get_tld():
     assert get_tld("https://api.epa.gov/easey/bulk-files") == "gov"
     assert get_tld("https://www.example.com") == "com"
@@ -73,3 +91,30 @@ def test_is_valid_url():
     assert is_valid_url("http://") is False
     assert is_valid_url("http://example") is False
     assert is_valid_url("example.com") is False
+
+
+def test_preallocate(tmp_path):
+    path = tmp_path / "file.bin"
+    with open(path, "wb") as f:
+        preallocate(f.fileno(), 4096)
+        f.write(b"abc")
+        f.truncate()
+    assert path.read_bytes() == b"abc"
+
+
+def test_list_files(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "top.txt").write_text("x")
+    (tmp_path / "a" / "b" / "deep.txt").write_text("x")
+    assert list_files(str(tmp_path)) == {str(tmp_path / "top.txt"), str(tmp_path / "a" / "b" / "deep.txt")}
+    assert list_files(str(tmp_path / "missing")) == set()
+
+
+def test_is_file_with_extension():
+    assert is_file_with_extension("john") is False
+    assert is_file_with_extension("john.txt") is True
+    assert is_file_with_extension("john.txt/") is False
+    assert is_file_with_extension("/some/dir/john.txt") is True
+    assert is_file_with_extension("/some/dir.d/john") is False
+    assert is_file_with_extension(".bashrc") is False
+    assert is_file_with_extension(".hidden.txt") is True